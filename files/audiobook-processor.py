@@ -1,30 +1,298 @@
 import argparse
+import asyncio
+import functools
+import json
+import logging
 import numbers
 import subprocess
 import math
 import os
+import sys
 from pathlib import Path
 
+try:
+    # Optional, reads container durations without spawning ffprobe
+    import mutagen
+except ImportError:
+    mutagen = None
+
+logger = logging.getLogger(__name__)
+
+# Audio codecs that can be split without re-encoding, and the extension of their output files
+STREAM_COPY_EXTENSIONS = {
+    'mp3': 'mp3',
+    'aac': 'm4a',
+}
+
+# Keep ffmpeg away from the terminal, only errors are reported
+FFMPEG_QUIET_ARGS = ['-hide_banner', '-nostdin', '-loglevel', 'error', '-nostats']
+
+# Start of every FFMpeg command
+FFMPEG_BASE_ARGS = [
+    'ffmpeg',
+    *FFMPEG_QUIET_ARGS,
+    '-y',  # Overwrite output files if exist
+]
+
+# Concurrent ffmpeg processes are capped, past a few of them the per-process
+# OS overhead outweighs the gain and the disk becomes the bottleneck
+MAX_DEFAULT_JOBS = 4
+
+
+def _sidecar_path(input_file):
+    """Path of the JSON file caching probe results next to the input file"""
+    return input_file + '.duration.json'
+
+
+def _load_sidecar(input_file, mtime, size):
+    """Load cached probe results, or an empty dict if missing or stale"""
+    try:
+        with open(_sidecar_path(input_file), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(cached, dict) or cached.get('mtime') != mtime or cached.get('size') != size:
+        return {}
+    return cached
+
+
+def _store_sidecar(input_file, mtime, size, **values):
+    """Merge probe results into the sidecar file, failing silently on read-only media"""
+    cached = _load_sidecar(input_file, mtime, size)
+    cached.update(values, mtime=mtime, size=size)
+    try:
+        with open(_sidecar_path(input_file), 'w', encoding='utf-8') as f:
+            json.dump(cached, f)
+    except OSError:
+        pass
+
+
+def _read_container_duration(input_file):
+    """Get the duration from the container header with mutagen, or 0 if unavailable"""
+    if mutagen is None:
+        return 0
+    try:
+        media = mutagen.File(input_file)
+    except Exception:
+        return 0
+    if media is None or media.info is None:
+        return 0
+    return float(getattr(media.info, 'length', 0) or 0)
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_duration(input_file, mtime, size):
+    """Get the duration from the sidecar cache, the container header or ffprobe, in that order"""
+    cached = _load_sidecar(input_file, mtime, size)
+    if 'duration' in cached:
+        return float(cached['duration'])
+
+    duration = _read_container_duration(input_file)
+    if duration:
+        _store_sidecar(input_file, mtime, size, duration=duration)
+        return duration
 
-def get_duration(input_file):
-    """Get the duration of the audio file in seconds using ffprobe"""
     cmd = [
         'ffprobe',
         '-v', 'quiet',
+        '-read_intervals', '%+#1',  # Stop after the first packet, the duration is in the header
         '-show_entries', 'format=duration',
         '-of', 'default=noprint_wrappers=1:nokey=1',
         input_file
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    # Raw bytes, float() accepts them directly without decoding the output first
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=False)
+
+    if result.stdout.strip():
+        duration = float(result.stdout)
+        _store_sidecar(input_file, mtime, size, duration=duration)
+        return duration
+    if result.stderr:
+        logger.error(f"Error: {result.stderr.decode(errors='replace')}")
+    return 0
+
+
+def get_duration(input_file):
+    """Get the duration of the audio file in seconds using ffprobe, cached across runs"""
+    try:
+        stat = os.stat(input_file)
+    except OSError as e:
+        logger.error(f"Error: {e}")
+        return 0
+
+    duration = _probe_duration(input_file, stat.st_mtime, stat.st_size)
+    if duration:
+        logger.info(f"Total duration: {duration} seconds")
+    return duration
+
+
+@functools.lru_cache(maxsize=None)
+def _probe_codec(input_file, mtime, size):
+    """Get the first audio stream's codec from the sidecar cache, or probe it with ffprobe"""
+    cached = _load_sidecar(input_file, mtime, size)
+    if 'codec_name' in cached:
+        return cached['codec_name']
+
+    cmd = [
+        'ffprobe',
+        '-v', 'quiet',
+        '-select_streams', 'a:0',
+        '-show_entries', 'stream=codec_name',
+        '-of', 'default=noprint_wrappers=1:nokey=1',
+        input_file
+    ]
+    result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True, text=False)
+
+    codec_name = result.stdout.strip().decode(errors='replace')
+    if codec_name:
+        _store_sidecar(input_file, mtime, size, codec_name=codec_name)
+    return codec_name
+
+
+def get_audio_codec(input_file):
+    """Get the codec name of the audio stream using ffprobe, cached across runs"""
+    try:
+        stat = os.stat(input_file)
+    except OSError:
+        return ""
+    return _probe_codec(input_file, stat.st_mtime, stat.st_size)
+
+
+def default_jobs() -> int:
+    """Default number of concurrent ffmpeg processes"""
+    return min(os.cpu_count() or 1, MAX_DEFAULT_JOBS)
+
+
+@functools.lru_cache(maxsize=64)
+def build_atempo_chain(speed_factor: float) -> str:
+    """Build the atempo filter chain for the given speed factor, memoised per factor"""
+    if speed_factor <= 0.0:
+        raise ValueError(f"Speed factor must be positive, got {speed_factor}")
+
+    # atempo filter is limited to 0.5 to 2.0 range
+    # for larger changes, we need to chain multiple atempo filters
+    # frexp gives speed_factor = mantissa * 2 ** exponent with mantissa in [0.5, 1),
+    # so the number of full steps comes from the exponent without a float log
+    mantissa, exponent = math.frexp(speed_factor)
+    if speed_factor > 2.0:
+        count = exponent - 1
+        step, remainder = 2.0, math.ldexp(speed_factor, -count)
+    elif speed_factor < 0.5:
+        count = -exponent + (mantissa == 0.5)
+        step, remainder = 0.5, math.ldexp(speed_factor, count)
+    else:
+        return f'atempo={speed_factor}'
 
-    if not result.stdout.rstrip() == "":
-        print(f"Total duration: {result.stdout.rstrip()} seconds")
-        return float(result.stdout.rstrip())
-    if not result.stderr == "":
-        print(f"Error: {result.stderr}")
+    chain = [f'atempo={step}'] * count
+    if remainder != 1.0:
+        chain.append(f'atempo={remainder}')
+    return ','.join(chain)
+
+
+def _segment_and_encode(
+        input_file: str,
+        output_dir: str,
+        chunk_seconds: int,
+        speed_factor: float,
+        output_args: list,
+        start_chunk: int,
+        max_chunks: int = None,
+        extension: str = 'mp3',
+) -> int:
+    """
+    Split and encode the input file in a single FFMpeg pass using the segment muxer
+
+    The input is opened, seeked and demuxed once instead of once per chunk.
+
+    Returns:
+        The ffmpeg return code
+    """
+    # '%' is the segment number placeholder, escape any in the output path
+    prefix = os.path.join(output_dir, Path(input_file).stem).replace('%', '%%')
+    output_template = f"{prefix}_%03d.{extension}"
+
+    # Build FFMpeg command, seeking on the input so it happens only once
+    cmd = list(FFMPEG_BASE_ARGS)
+    if start_chunk > 1:
+        cmd.extend(['-ss', str(chunk_seconds * (start_chunk - 1))])  # Start time
+    if max_chunks is not None:
+        cmd.extend(['-t', str(chunk_seconds * max_chunks)])  # Duration to extract
+    cmd.extend(['-i', input_file])  # Input file
+
+    # Segments are cut on the output timeline, which the tempo filter rescales
+    segment_time = chunk_seconds / speed_factor if speed_factor != 1.0 else chunk_seconds
+
+    # Add output options
+    cmd.extend(output_args)
+    cmd.extend([
+        '-f', 'segment',
+        '-segment_time', str(segment_time),
+        '-segment_start_number', str(start_chunk),
+        '-reset_timestamps', '1',
+        output_template
+    ])
+
+    # Execute FFMpeg command
+    logger.info(f"\n\rCommand:\n\r{' '.join(cmd)}\n\r")
+    try:
+        subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Error processing chunks: {e}\n\r{e.stderr.decode(errors='replace')}")
+        return e.returncode
     return 0
 
 
+async def _encode_chunk(
+        semaphore: asyncio.Semaphore,
+        i: int,
+        output_file: str,
+        start_time: float,
+        duration: float,
+        cmd_suffix: list,
+):
+    """
+    Encode a single chunk of the input file with FFMpeg, once the semaphore allows it
+
+    cmd_suffix holds the input file and output options, which are the same for
+    every chunk, only the seek range and output file are added here.
+
+    Returns:
+        Tuple of (chunk index, ffmpeg return code, ffmpeg stderr output)
+    """
+    # Build FFMpeg command, both as input options so the demuxer seeks and the
+    # duration is measured on the input, before any tempo change
+    cmd = FFMPEG_BASE_ARGS + [
+        '-ss', f'{start_time}',  # Start time
+        '-t', f'{duration}',  # Duration to extract
+    ] + cmd_suffix + [output_file]
+
+    async with semaphore:
+        # Execute FFMpeg command
+        logger.info(f"Processing chunk {i + 1}: {output_file}\n\rCommand:\n\r{' '.join(cmd)}\n\r")
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+    return i, process.returncode, stderr.decode(errors='replace')
+
+
+async def _encode_chunks(chunks: list, jobs: int, total_chunks: int) -> None:
+    """Encode all chunks with at most `jobs` FFMpeg processes running at once"""
+    semaphore = asyncio.Semaphore(max(1, jobs))
+    # Tasks are created in chunk order so they take the semaphore in that order
+    tasks = [asyncio.ensure_future(_encode_chunk(semaphore, *chunk)) for chunk in chunks]
+    for task in asyncio.as_completed(tasks):
+        i, returncode, stderr = await task
+        if returncode != 0:
+            logger.error(f"Error processing chunk {i + 1}: {stderr}")
+        else:
+            logger.info(f"Finished chunk {i + 1}/{total_chunks}")
+
+
 def process_audiobook(
         input_file: str,
         output_dir: str,
@@ -32,8 +300,12 @@ def process_audiobook(
         speed_factor: float = 1.05,
         start_chunk: int = 1,
         max_chunks: int = None,
-        audio_quality: int = "192",
-        sample_rate: int = "44100",
+        audio_quality: int = None,
+        sample_rate: int = None,
+        jobs: int = None,
+        legacy_per_chunk: bool = False,
+        mp3_compression: int = None,
+        stream_copy: bool = True,
 ) -> None:
     """
     Process an M4B audiobook file (or any other media supported by FFMpeg)
@@ -45,8 +317,19 @@ def process_audiobook(
         speed_factor: Speed adjustment factor (1.0 = normal speed)
         start_chunk: First chunk to process (1-based indexing)
         max_chunks: Maximum number of chunks to process (None = process all)
-        audio_quality: Output audio bitrate
-        sample_rate: Output audio sample rate
+        audio_quality: Output audio bitrate (None = 192)
+        sample_rate: Output audio sample rate (None = 44100)
+        jobs: Number of chunks encoded concurrently (None = min(cpu count, 4)),
+            only used with legacy_per_chunk
+        legacy_per_chunk: Run one FFMpeg process per chunk instead of a single segmenting pass
+        mp3_compression: libmp3lame compression level, 0 (best quality, slowest) to 9 (fastest)
+            (None = 2)
+        stream_copy: At normal speed, split MP3 and AAC audio without re-encoding it,
+            unless audio_quality, sample_rate or mp3_compression is given
+
+    FFMpeg is started with -threads 0 so it picks its own thread count. With
+    legacy_per_chunk and jobs > 1 several processes already share the cores,
+    where -threads 1 per process may be better to avoid oversubscription.
     """
 
     # Create output directory if it doesn't exist
@@ -55,73 +338,79 @@ def process_audiobook(
     # Get total duration
     total_duration = get_duration(input_file)
     if total_duration == 0:
-        print(f"Cannot determine total audiobook duration, make sure the file is valid.\n\rFile: {input_file}")
+        logger.error(f"Cannot determine total audiobook duration, make sure the file is valid.\n\rFile: {input_file}")
         return
 
-    chunk_seconds = chunk_duration * 60
-    total_chunks = math.ceil(total_duration / chunk_seconds)
+    chunk_seconds = int(chunk_duration) * 60
+    # Ceiling division without going through math.ceil
+    total_chunks = int(-(-total_duration // chunk_seconds))
 
     if max_chunks is not None:
         total_chunks = min(total_chunks, start_chunk + max_chunks - 1)
 
-    print(f"Total duration: {total_duration / 60:.1f} minutes")
-    print(f"Processing chunks {start_chunk} to {total_chunks}")
-
-    # Process each chunk
-    for i in range(start_chunk - 1, total_chunks):
-        start_time = i * chunk_seconds
-        duration = min(chunk_seconds, total_duration - start_time)
+    logger.info(f"Total duration: {total_duration / 60:.1f} minutes")
+    logger.info(f"Processing chunks {start_chunk} to {total_chunks}")
 
-        output_file = os.path.join(
-            output_dir,
-            f"{Path(input_file).stem}_{i + 1:03}.mp3"
-        )
-
-        # Build FFMpeg command
-        cmd = [
-            'ffmpeg',
-            '-y',  # Overwrite output file if exists
-            '-ss', str(start_time),  # Start time
-            '-i', input_file,  # Input file
-            '-t', str(duration),  # Duration to extract
-        ]
+    if speed_factor <= 0.0:
+        logger.error(f"Speed factor must be positive, operation aborted.")
+        return
 
-        # Add speed adjustment filter if needed
-        if (speed_factor <= 0.0) or ((1 / speed_factor % 2) <= 0.0):
-            print(f"Speed factor is too small, operation aborted.")
-            return
+    # Nothing to filter at normal speed, copy the audio as-is if its codec allows,
+    # unless encoder options were asked for explicitly
+    encoder_options = (audio_quality, sample_rate, mp3_compression)
+    extension = None
+    if stream_copy and speed_factor == 1.0 and all(option is None for option in encoder_options):
+        extension = STREAM_COPY_EXTENSIONS.get(get_audio_codec(input_file))
 
+    # Output options are the same for every chunk, build them once
+    output_args = []
+    if extension is not None:
+        logger.info(f"Splitting without re-encoding to .{extension} files")
+        output_args.extend([
+            '-c', 'copy',           # Copy the audio stream
+            '-map', '0:a',          # Remove video
+            '-map_metadata', '-1',  # Remove metadata
+        ])
+    else:
+        extension = 'mp3'
+        audio_quality = "192" if audio_quality is None else audio_quality
+        sample_rate = "44100" if sample_rate is None else sample_rate
+        mp3_compression = 2 if mp3_compression is None else mp3_compression
         if speed_factor != 1.0:
-            # atempo filter is limited to 0.5 to 2.0 range
-            # for larger changes, we need to chain multiple atempo filters
-            if speed_factor > 2.0:
-                tempo_chain = ','.join(['atempo=2.0'] * (math.floor(speed_factor / 2)) +
-                                       [f'atempo={speed_factor % 2}'])
-            elif speed_factor < 0.5:
-                tempo_chain = ','.join(['atempo=0.5'] * (math.floor(2 / speed_factor)) +
-                                       [f'atempo={1 / (1 / speed_factor % 2)}'])
-            else:
-                tempo_chain = f'atempo={speed_factor}'
-
-            cmd.extend(['-filter:a', tempo_chain])
-
-        # Add output options
-        cmd.extend([
+            # Add speed adjustment filter
+            output_args.extend(['-filter:a', build_atempo_chain(speed_factor)])
+        output_args.extend([
+            '-c:a', 'libmp3lame',  # MP3 encoder
+            '-compression_level', f'{mp3_compression}',  # Encoder speed/quality trade-off
+            '-threads', '0',        # Let FFMpeg pick the thread count
             '-b:a', f'{audio_quality}k',  # Audio bitrate
             '-map_metadata', '-1',  # Remove metadata
             '-map', 'a',            # Remove video
             '-ar', f'{sample_rate}',         # Sample Rate
-            output_file
         ])
 
-        # Execute FFMpeg command
-        print(f"Processing chunk {i + 1}/{total_chunks}: {output_file}")
-        try:
-            print(f"\n\rCommand:\n\r{' '.join(cmd)}\n\r")
-            subprocess.run(cmd, check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Error processing chunk {i + 1}: {e}")
-            continue
+    if not legacy_per_chunk:
+        _segment_and_encode(
+            input_file, output_dir, chunk_seconds, speed_factor,
+            output_args, start_chunk, max_chunks, extension
+        )
+        return
+
+    # Build the work list, each chunk is independent of the others
+    stem = Path(input_file).stem
+    cmd_suffix = ['-i', input_file, *output_args]
+    chunks = [
+        (i, os.path.join(output_dir, f"{stem}_{i + 1:03}.{extension}"),
+         i * chunk_seconds, min(chunk_seconds, total_duration - i * chunk_seconds),
+         cmd_suffix)
+        for i in range(start_chunk - 1, total_chunks)
+    ]
+
+    if jobs is None:
+        jobs = default_jobs()
+
+    # ffmpeg does the heavy lifting in its own process, the event loop only waits on them
+    asyncio.run(_encode_chunks(chunks, jobs, total_chunks))
 
 
 def main():
@@ -136,13 +425,29 @@ def main():
                         help="First chunk to process (default: 1)")
     parser.add_argument("--max-chunks", type=int,
                         help="Maximum number of chunks to process (default: all)")
-    parser.add_argument("--quality", default="192",
-                        help="Output audio bitrate (default: 192k)")
-    parser.add_argument("--sample-rate", default="44100",
-                        help="Output audio bitrate (default: 44100k)")
+    parser.add_argument("--quality",
+                        help="Output audio bitrate (default: 192k). No effect when the audio is "
+                             "copied as-is at normal speed, so giving it forces re-encoding")
+    parser.add_argument("--sample-rate",
+                        help="Output audio sample rate (default: 44100). No effect when the audio "
+                             "is copied as-is at normal speed, so giving it forces re-encoding")
+    parser.add_argument("--jobs", type=int, default=default_jobs(),
+                        help=f"Number of chunks encoded in parallel with --legacy-per-chunk "
+                             f"(default: {default_jobs()})")
+    parser.add_argument("--mp3-compression", type=int, choices=range(10),
+                        metavar="{0..9}",
+                        help="MP3 encoder compression level, 0 = best quality/slowest, "
+                             "9 = fastest (default: 2). Giving it forces re-encoding")
+    parser.add_argument("--no-copy", dest="stream_copy", action="store_false",
+                        help="Always re-encode to MP3, even when the audio could be copied as-is")
+    parser.add_argument("--legacy-per-chunk", action="store_true",
+                        help="Run one FFMpeg process per chunk instead of a single segmenting pass")
     
     args = parser.parse_args()
 
+    # Progress goes to stdout like the print calls it replaced
+    logging.basicConfig(level=logging.INFO, format='%(message)s', stream=sys.stdout)
+
     process_audiobook(
         args.input_file,
         args.output_dir,
@@ -151,7 +456,11 @@ def main():
         args.start_chunk,
         args.max_chunks,
         args.quality,
-        args.sample_rate
+        args.sample_rate,
+        args.jobs,
+        args.legacy_per_chunk,
+        args.mp3_compression,
+        args.stream_copy
     )
 
 
@@ -1,79 +1,363 @@
+import argparse
+import codecs
+import functools
 import os
 import mimetypes
-import pathlib
-from typing import List, Set
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AbstractSet, Iterable, Iterator, List, Optional, Tuple
 
-def is_text_file(filepath: str, text_extensions: Set[str]) -> bool:
+# Define the extensions you want to include
+TEXT_EXTENSIONS = frozenset({
+    '.h', '.cpp', '.cs', '.py', '.json', '.xml', '.txt', '.md', 
+    '.ini', '.config', '.yaml', '.yml', '.uplugin', '.build',
+    '.html', '.css', '.js', '.java', '.swift', '.m', '.mm',
+    '.sh', '.bat', '.cmd', '.ps1', '.gradle', '.properties'
+})
+# Same extensions without the leading dot, as matched against name.rpartition('.')
+_TEXT_EXTS = frozenset(ext.lstrip('.').lower() for ext in TEXT_EXTENSIONS)
+
+# Files larger than this are skipped, they are unlikely to be hand written source
+MAX_FILE_BYTES = 10 * 1024 * 1024
+# Files up to this size are read ahead by worker threads, larger ones are streamed
+PREFETCH_MAX_BYTES = 4 * 1024 * 1024
+# Size of the combined output file's write buffer
+OUTPUT_BUFFER_BYTES = 1024 * 1024
+# Written after each file's content
+FILE_FOOTER = b"\n```\n\n\n"
+# Maximum number of files read ahead of the one being written, bounds memory use
+MAX_IN_FLIGHT = 32
+
+def _bare_extensions(text_extensions: AbstractSet[str]) -> AbstractSet[str]:
     """
-    Determine if a file is a text file based on its extension and mime type.
+    Extensions without the leading dot, precomputed for the default set.
+    """
+    if text_extensions is TEXT_EXTENSIONS:
+        return _TEXT_EXTS
+    return frozenset(ext.lstrip('.').lower() for ext in text_extensions)
+
+@functools.lru_cache(maxsize=4096)
+def _guess_mime_type(ext: str) -> Optional[str]:
+    """
+    Mime type for a lowercase extension without its dot, looked up once per extension.
+    """
+    if not ext:
+        return None
+    # mimetypes loads its database on the first call only
+    return mimetypes.guess_type('x.' + ext)[0]
+
+def _is_wanted(name: str, extensions: AbstractSet[str], use_mime: bool) -> bool:
+    """
+    Check a file name against the dot-less extensions, then the mime type if use_mime is set.
     """
     # Check if extension is in our allowed list
-    ext = pathlib.Path(filepath).suffix.lower()
-    if ext in text_extensions:
+    _, dot, ext = name.rpartition('.')
+    ext = ext.lower() if dot else ''
+    if ext and ext in extensions:
         return True
-    
+    if not use_mime:
+        return False
+
     # Use mime type as fallback
-    mime_type, _ = mimetypes.guess_type(filepath)
+    mime_type = _guess_mime_type(ext)
     return mime_type is not None and mime_type.startswith('text/')
 
-def collect_files(directory: str, text_extensions: Set[str]) -> List[str]:
+def is_text_file(filepath: str, text_extensions: AbstractSet[str] = TEXT_EXTENSIONS) -> bool:
+    """
+    Determine if a file is a text file based on its extension and mime type.
+    """
+    return _is_wanted(os.path.basename(filepath), _bare_extensions(text_extensions), True)
+
+def walk_mt(top: str, threads: int = 32) -> List[Tuple[str, List[str]]]:
+    """
+    Recursively list the files under top using a pool of threads.
+
+    Each directory is scanned by whichever worker picks it up first, so slow
+    filesystems (network mounts, FUSE) get many scandir calls in flight at
+    once. Returns (directory, file names) pairs in no particular order.
+    """
+    paths = [top]
+    output = []
+    # Directories queued or being scanned, the walk is done when it drops to zero
+    pending = 1
+    lock = threading.Lock()
+    on_input = threading.Condition(lock)
+    on_output = threading.Condition(lock)
+
+    def worker():
+        nonlocal pending
+        while True:
+            with lock:
+                while not paths and pending:
+                    on_input.wait()
+                if not pending:
+                    return
+                path = paths.pop()
+
+            dirs = []
+            files = []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append(entry.path)
+                        elif entry.is_file():
+                            files.append(entry.name)
+            except OSError:
+                # Unreadable directory, skip it like os.walk does
+                pass
+
+            with lock:
+                paths.extend(dirs)
+                output.append((path, files))
+                pending += len(dirs) - 1
+                if dirs:
+                    on_input.notify(len(dirs))
+                if not pending:
+                    on_input.notify_all()
+                    on_output.notify()
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(max(1, threads))]
+    for thread in workers:
+        thread.start()
+    with lock:
+        while pending:
+            on_output.wait()
+    for thread in workers:
+        thread.join()
+
+    return output
+
+def iter_files(directory: str, text_extensions: AbstractSet[str] = TEXT_EXTENSIONS,
+               use_mime: bool = False) -> Iterator[str]:
+    """
+    Recursively yield all text files in the given directory.
+
+    Unlike collect_files, nothing but the directories still to visit is kept in
+    memory. Files come out in the same tree order as collect_files returns
+    them: each directory's files sorted by name, followed by its
+    subdirectories in name order.
+    """
+    extensions = _bare_extensions(text_extensions)
+
+    stack = [directory]
+    while stack:
+        root = stack.pop()
+        dirs = []
+        files = []
+        try:
+            with os.scandir(root) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.name)
+                    elif entry.is_file():
+                        files.append(entry.name)
+        except OSError:
+            # Unreadable directory, skip it like os.walk does
+            continue
+
+        files.sort()
+        for name in files:
+            if _is_wanted(name, extensions, use_mime):
+                yield os.path.join(root, name)
+
+        # Reversed so the stack pops subdirectories in name order
+        dirs.sort(reverse=True)
+        stack.extend(os.path.join(root, name) for name in dirs)
+
+def collect_files(directory: str, text_extensions: AbstractSet[str] = TEXT_EXTENSIONS,
+                  use_mime: bool = False, threads: int = 32) -> List[str]:
     """
     Recursively collect all text files in the given directory.
+
+    Files are matched on their extension only, unless use_mime is set in which
+    case the mime type is used as a fallback for unknown extensions. The result
+    is in tree order: each directory's files sorted by name, followed by its
+    subdirectories in name order. This is the same order iter_files yields,
+    so the combined output does not depend on which walker is used.
     """
-    text_files = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            filepath = os.path.join(root, file)
-            if is_text_file(filepath, text_extensions):
-                text_files.append(filepath)
+    extensions = _bare_extensions(text_extensions)
+
+    # Files are kept as (directory index, name) so sorting compares short names
+    # instead of full paths sharing long prefixes
+    dirs: List[str] = []
+    entries: List[Tuple[int, str]] = []
+    for root, files in walk_mt(directory, threads):
+        idx = len(dirs)
+        dirs.append(root)
+        for name in files:
+            if _is_wanted(name, extensions, use_mime):
+                entries.append((idx, name))
 
-    # Sort for consistent output
-    return sorted(text_files)
+    # Sort for consistent output, the concurrent walk does not preserve any order.
+    # Directory indices are remapped to their sorted rank first, so files are
+    # ordered by directory then by name. Directories are compared by path
+    # components, so a directory's subtree comes right after it rather than
+    # after siblings such as 'a-b' or 'a.c' that sort before '/'.
+    order = sorted(range(len(dirs)), key=lambda idx: dirs[idx].split(os.sep))
+    rank = [0] * len(dirs)
+    for position, idx in enumerate(order):
+        rank[idx] = position
+    entries = [(rank[idx], name) for idx, name in entries]
+    entries.sort()
+
+    dirs = [dirs[idx] for idx in order]
+    return [os.path.join(dirs[idx], name) for idx, name in entries]
+
+class SkippedFile(Exception):
+    """
+    Raised when a file is left out of the combined output.
+    """
 
-def create_combined_file(files: List[str], output_file: str):
+def _read_bytes(filepath: str, max_bytes: int = MAX_FILE_BYTES) -> Optional[bytes]:
+    """
+    Read a file body for the combined output.
+
+    Only the first 4KB are read before deciding whether the file is text, so
+    binary files are rejected without loading them. Returns None when the file
+    is too large to be read ahead and must be streamed instead. Raises
+    SkippedFile if it is larger than max_bytes (0 = no limit) or does not look
+    like UTF-8 text.
+    """
+    with open(filepath, 'rb') as infile:
+        size = os.fstat(infile.fileno()).st_size
+        if max_bytes and size > max_bytes:
+            raise SkippedFile(f"{filepath} is larger than {max_bytes} bytes")
+
+        head = infile.read(4096)
+        if b'\x00' in head:
+            raise SkippedFile(f"{filepath} looks like a binary file")
+        try:
+            # Incremental decoder so a character split at the block end is not an error
+            codecs.getincrementaldecoder('utf-8')().decode(head)
+        except UnicodeDecodeError:
+            raise SkippedFile(f"Could not read {filepath} as text")
+
+        if size > PREFETCH_MAX_BYTES:
+            return None
+        return head + infile.read()
+
+def _copy_body(infile, outfile):
+    """
+    Copy a whole file into the output, in the kernel where os.copy_file_range is available.
+    """
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        # Pending header bytes must reach the fd before the kernel appends to it
+        outfile.flush()
+        try:
+            while True:
+                copied = os.copy_file_range(infile.fileno(), outfile.fileno(), 1 << 30, offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError:
+            # Unsupported for this pair of files (e.g. across filesystems), copy the rest in user space
+            pass
+        # The fd position moved behind the buffered writer's back, resynchronise it
+        outfile.seek(0, os.SEEK_END)
+
+    infile.seek(offset)
+    shutil.copyfileobj(infile, outfile, 1024 * 1024)
+
+def _write_entry(outfile, filepath: str, body: Future) -> bool:
+    """
+    Write one file of the combined output, once its read has completed.
+
+    Returns whether the file was written.
+    """
+    try:
+        content = body.result()
+        header = b"// Filepath: " + filepath.encode('utf-8') + b"\n\n\n```\n"
+
+        if content is None:
+            # Large file, stream it between the header and footer
+            with open(filepath, 'rb') as infile:
+                start = outfile.tell()
+                try:
+                    outfile.write(header)
+                    _copy_body(infile, outfile)
+                    outfile.write(FILE_FOOTER)
+                except Exception:
+                    # Drop the partial entry rather than leave an unclosed fence behind
+                    outfile.seek(start)
+                    outfile.truncate()
+                    raise
+        else:
+            # Header, content and footer in a single write
+            outfile.write(b"".join((header, content, FILE_FOOTER)))
+        return True
+    except SkippedFile as e:
+        print(f"Warning: {e}. Skipping.")
+    except Exception as e:
+        print(f"Error processing {filepath}: {str(e)}")
+    return False
+
+def create_combined_file(files: Iterable[str], output_file: str, threads: int = 8,
+                         max_bytes: int = MAX_FILE_BYTES) -> int:
     """
     Create a single file containing the content of all input files with proper formatting.
+
+    File bodies are read by a pool of threads while the calling thread writes
+    them out in the original order. files may be any iterable, such as
+    iter_files(), and is consumed lazily. Files larger than max_bytes
+    (0 = no limit), binary or not UTF-8 are skipped, as is output_file itself
+    when the scanned tree contains it.
+
+    Returns the number of files written.
     """
-    with open(output_file, 'w', encoding='utf-8') as outfile:
+    written = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor, \
+            open(output_file, 'wb', buffering=OUTPUT_BUFFER_BYTES) as outfile:
+        # The output exists before the tree is scanned, never include it in itself
+        output_stat = os.fstat(outfile.fileno())
+        output_name = os.path.basename(output_file)
         for filepath in files:
-            try:
-                with open(filepath, 'r', encoding='utf-8') as infile:
-                    # Write file header
-                    outfile.write(f"// Filepath: {filepath}\n\n\n")
-                    outfile.write("```\n")
-                    
-                    # Write file content
-                    outfile.write(infile.read())
-                    
-                    # Write file footer
-                    outfile.write("\n```\n\n\n")
-            except UnicodeDecodeError:
-                print(f"Warning: Could not read {filepath} as text. Skipping.")
-            except Exception as e:
-                print(f"Error processing {filepath}: {str(e)}")
+            if os.path.basename(filepath) == output_name:
+                try:
+                    if os.path.samestat(os.stat(filepath), output_stat):
+                        continue
+                except OSError:
+                    pass
+            pending.append((filepath, executor.submit(_read_bytes, filepath, max_bytes)))
+            if len(pending) >= MAX_IN_FLIGHT:
+                written += _write_entry(outfile, *pending.popleft())
+        while pending:
+            written += _write_entry(outfile, *pending.popleft())
+    return written
 
 def main():
-    # Define the extensions you want to include
-    text_extensions = {
-        '.h', '.cpp', '.cs', '.py', '.json', '.xml', '.txt', '.md', 
-        '.ini', '.config', '.yaml', '.yml', '.uplugin', '.build',
-        '.html', '.css', '.js', '.java', '.swift', '.m', '.mm',
-        '.sh', '.bat', '.cmd', '.ps1', '.gradle', '.properties'
-    }
-    
     # Get directory from command line argument or use current directory
-    import sys
-    directory = sys.argv[1] if len(sys.argv) > 1 else '.'
+    parser = argparse.ArgumentParser(description="Combine all source files of a directory into a single file")
+    parser.add_argument("directory", nargs="?", default=".",
+                        help="Directory to scan (default: current directory)")
+    parser.add_argument("--use-mime", action="store_true",
+                        help="Also include files with an unknown extension but a text/* mime type")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="Scan directories with this many threads, collecting and sorting all "
+                             "paths first; useful on network filesystems (default: 0, stream "
+                             "files while scanning)")
+    parser.add_argument("--max-bytes", type=int, default=MAX_FILE_BYTES,
+                        help=f"Skip files larger than this, 0 for no limit (default: {MAX_FILE_BYTES})")
+    args = parser.parse_args()
+
+    directory = args.directory
     output_file = 'combined_source_code.txt'
     
     # Collect and process files
     print(f"Scanning directory: {directory}")
-    files = collect_files(directory, text_extensions)
-    print(f"Found {len(files)} text files")
+    if args.threads > 0:
+        files = collect_files(directory, TEXT_EXTENSIONS, args.use_mime, args.threads)
+        print(f"Found {len(files)} text files")
+    else:
+        files = iter_files(directory, TEXT_EXTENSIONS, args.use_mime)
     
     # Create combined file
-    create_combined_file(files, output_file)
-    print(f"Created combined file: {output_file}")
+    written = create_combined_file(files, output_file, max_bytes=args.max_bytes)
+    print(f"Created combined file: {output_file} ({written} files)")
 
 if __name__ == '__main__':
     main()
\ No newline at end of file